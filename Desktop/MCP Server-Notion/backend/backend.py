@@ -4,27 +4,37 @@ Enhanced with 256K context window for complex workspace analysis
 LangChain 1.2.0 compatible - FIXED with proper session management
 """
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import asyncio
+import anyio
+import hashlib
 import os
+import shutil
 import sys
-import traceback
-import json
-import re
+import logging
+import orjson
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
 
 # LangChain 1.2.0 imports
 from langchain_core.tools import Tool
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_fireworks import ChatFireworks
-from langchain_core.output_parsers import StrOutputParser
 
 # MCP imports
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
-app = FastAPI(title="Notion MCP Agent API")
+# Unknown LOG_LEVEL values fall back to INFO instead of failing at import
+_log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=logging.getLevelNamesMapping().get(_log_level, logging.INFO))
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Notion MCP Agent API", default_response_class=ORJSONResponse)
 
 # ------------------------------
 # CORS
@@ -51,52 +61,243 @@ class QueryRequest(BaseModel):
     fireworks_key: str
 
 
+async def read_json_body(request: Request) -> dict:
+    """Parse the request body with orjson instead of Starlette's stdlib json"""
+    return orjson.loads(await request.body())
+
+
 # ------------------------------
 # Root / Health Endpoints
 # ------------------------------
+# Static payload, serialized once at import
+ROOT_RESPONSE_BYTES = orjson.dumps({
+    "message": "Notion MCP Agent API with Kimi K2",
+    "model": "kimi-k2-instruct-0905",
+    "context_window": "256K tokens",
+    "status": "running",
+    "endpoints": {
+        "health": "/health",
+        "connect": "/api/connect",
+        "query": "/api/query"
+    }
+})
+
+
 @app.get("/")
 async def root():
-    return {
-        "message": "Notion MCP Agent API with Kimi K2",
-        "model": "kimi-k2-instruct-0905",
-        "context_window": "256K tokens",
-        "status": "running",
-        "endpoints": {
-            "health": "/health",
-            "connect": "/api/connect",
-            "query": "/api/query"
-        }
-    }
+    return Response(content=ROOT_RESPONSE_BYTES, media_type="application/json")
+
+
+HEALTH_RESPONSE_BYTES = orjson.dumps({"status": "healthy", "message": "Server is running"})
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "Server is running"}
+    return Response(content=HEALTH_RESPONSE_BYTES, media_type="application/json")
 
 
 # ------------------------------
 # MCP Connection Management
 # ------------------------------
+# Snapshot of the process environment for MCP subprocesses, taken once at import
+_BASE_ENV = dict(os.environ)
+
+# Prefer a globally installed server binary; otherwise let npx use its local
+# cache instead of checking the npm registry on every spawn
+_NOTION_MCP_BIN = shutil.which("notion-mcp-server")
+if _NOTION_MCP_BIN:
+    _MCP_COMMAND, _MCP_ARGS = _NOTION_MCP_BIN, []
+else:
+    _MCP_COMMAND = "npx.cmd" if sys.platform == "win32" else "npx"
+    _MCP_ARGS = ["-y", "--prefer-offline", "@notionhq/notion-mcp-server"]
+
+
 async def create_mcp_session(notion_key: str):
     """Create and return MCP session with proper context management"""
-    npx_cmd = "npx.cmd" if sys.platform == "win32" else "npx"
+    env = _BASE_ENV.copy()
+    env["NOTION_TOKEN"] = notion_key
 
     server_params = StdioServerParameters(
-        command=npx_cmd,
-        args=["-y", "@notionhq/notion-mcp-server"],
-        env={**os.environ.copy(), "NOTION_TOKEN": notion_key},
+        command=_MCP_COMMAND,
+        args=_MCP_ARGS,
+        env=env,
     )
 
     return server_params
 
 
+class PersistentMCPSession:
+    """Long-lived MCP session for one Notion token.
+
+    stdio_client/ClientSession are entered and exited inside a dedicated task
+    (anyio cancel scopes must be closed by the task that opened them); request
+    handlers share the open session until it is closed or the server dies.
+    """
+
+    def __init__(self, notion_key: str, cache_key: str):
+        self.notion_key = notion_key
+        self.cache_key = cache_key
+        self.session = None
+        self.tools = []
+        self.tools_by_name = {}
+        self.tool_schemas = []
+        self._ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._users = 0  # requests currently holding the session
+        self._evicted = False  # close once the last user releases it
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def closed(self) -> bool:
+        return self._task.done()
+
+    async def wait_ready(self):
+        """Wait until the MCP server is initialized; re-raises startup errors"""
+        await asyncio.shield(self._ready)
+
+    async def _run(self):
+        try:
+            server_params = await create_mcp_session(self.notion_key)
+            async with stdio_client(server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    async with asyncio.timeout(60):  # 60 second timeout for startup
+                        await session.initialize()
+                        tools_result = await session.list_tools()
+
+                    self.tools = tools_result.tools
+                    self.tools_by_name = {tool.name: tool for tool in self.tools}
+                    # OpenAI-style function schemas for native tool calling
+                    self.tool_schemas = [
+                        {
+                            "type": "function",
+                            "function": {
+                                "name": tool.name,
+                                "description": tool.description or "",
+                                "parameters": tool.inputSchema,
+                            },
+                        }
+                        for tool in self.tools
+                    ]
+                    self.session = session
+                    self._ready.set_result(None)
+
+                    await self._closing.wait()
+        except Exception as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            else:
+                logger.exception("MCP session terminated unexpectedly")
+        finally:
+            self.session = None
+            if not self._ready.done():
+                self._ready.set_exception(RuntimeError("MCP session closed before initialization"))
+
+    async def aclose(self):
+        self._closing.set()
+        if not self._ready.done():
+            # Still starting up: don't wait out the startup timeout
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    def acquire(self):
+        self._users += 1
+
+    def discard(self):
+        """Mark as unusable; it closes once the last user releases it"""
+        self._evicted = True
+
+    async def evict(self):
+        """Close now if idle, otherwise as soon as the last user releases it"""
+        self._evicted = True
+        if self._users == 0:
+            await self.aclose()
+
+    async def release(self):
+        self._users -= 1
+        if self._evicted and self._users == 0:
+            await self.aclose()
+
+
+MAX_MCP_SESSIONS = 8
+_mcp_sessions: OrderedDict[str, PersistentMCPSession] = OrderedDict()
+
+
+def discard_mcp_session(mcp: PersistentMCPSession):
+    """Drop a broken session from the cache so the next request starts a fresh one"""
+    if _mcp_sessions.get(mcp.cache_key) is mcp:
+        del _mcp_sessions[mcp.cache_key]
+    mcp.discard()
+
+
+@asynccontextmanager
+async def mcp_session(notion_key: str):
+    """Hold the cached MCP session for notion_key, starting one if needed (LRU capped).
+
+    Held sessions are never closed by eviction; the close is deferred until
+    the last holder leaves this block.
+    """
+    cache_key = hashlib.sha256(notion_key.encode()).hexdigest()
+    mcp = _mcp_sessions.get(cache_key)
+
+    if mcp is None or mcp.closed:
+        mcp = PersistentMCPSession(notion_key, cache_key)
+        _mcp_sessions[cache_key] = mcp
+    else:
+        _mcp_sessions.move_to_end(cache_key)
+    mcp.acquire()
+
+    try:
+        while len(_mcp_sessions) > MAX_MCP_SESSIONS:
+            _, evicted = _mcp_sessions.popitem(last=False)
+            await evicted.evict()
+
+        try:
+            await mcp.wait_ready()
+        except Exception:
+            discard_mcp_session(mcp)
+            raise
+
+        yield mcp
+    finally:
+        await mcp.release()
+
+
+@app.on_event("shutdown")
+async def close_mcp_sessions():
+    sessions = list(_mcp_sessions.values())
+    _mcp_sessions.clear()
+    await asyncio.gather(*(mcp.aclose() for mcp in sessions), return_exceptions=True)
+
+
+# ------------------------------
+# Fireworks LLM Client
+# ------------------------------
+# Generation budgets: the tool-selection turn only emits a tool call (or a
+# short direct answer); the summary turn writes the user-facing answer
+TOOL_STEP_MAX_TOKENS = 512
+TOOL_STEP_RETRY_MAX_TOKENS = 4096  # one retry when a tool call is cut off
+SUMMARY_MAX_TOKENS = 1024
+
+
+@lru_cache(maxsize=32)
+def get_llm(fireworks_key: str) -> ChatFireworks:
+    """Return a cached ChatFireworks per API key so its HTTP connection pool is reused across queries"""
+    # Fireworks Kimi K2 LLM - Lower temperature for better instruction following
+    return ChatFireworks(
+        model="accounts/fireworks/models/kimi-k2-instruct-0905",
+        api_key=fireworks_key,
+        temperature=0.3,  # Lower for more deterministic behavior
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+
+
 # ------------------------------
 # Connect Endpoint
 # ------------------------------
 @app.post("/api/connect")
 async def connect_notion(request: Request):
     try:
-        body = await request.json()
+        body = await read_json_body(request)
         notion_key = body.get("notion_key", "").strip()
         fireworks_key = body.get("fireworks_key", "").strip()
 
@@ -105,15 +306,9 @@ async def connect_notion(request: Request):
         if not fireworks_key:
             raise HTTPException(400, "Fireworks API key required")
 
-        # Test connection with longer timeout
-        server_params = await create_mcp_session(notion_key)
-        
-        async with asyncio.timeout(60):  # 60 second timeout for connection
-            async with stdio_client(server_params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tool_names = [tool.name for tool in tools_result.tools]
+        # Starts (or reuses) the persistent session, so the first query skips the MCP handshake
+        async with mcp_session(notion_key) as mcp:
+            tool_names = list(mcp.tools_by_name)
 
         return {
             "status": "connected",
@@ -122,238 +317,208 @@ async def connect_notion(request: Request):
             "tools": tool_names,
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(traceback.format_exc())
+        logger.exception("Notion connection failed")
         raise HTTPException(500, f"Connection failed: {str(e)}")
 
 
 # ------------------------------
-# Helper: Extract Complete JSON from Text
+# Agent Prompt
 # ------------------------------
-def extract_complete_json(text: str) -> dict:
-    """Extract the first complete JSON object from text"""
-    if not text or not isinstance(text, str):
-        return None
-    
-    text = text.strip()
-    
-    # Try direct JSON parse first (handles simple cases like {} or {"key": "value"})
-    if text.startswith('{'):
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            pass  # Continue to extraction logic
+# Tool-selection turn: the model either calls tools or answers directly; tool
+# results are handed to the summary turn, not back to this prompt
+AGENT_SYSTEM_PROMPT = """You are an expert AI assistant with access to Notion workspace tools.
+
+CRITICAL INSTRUCTIONS:
+1. If the request needs workspace data or changes, respond with all the tool calls it requires in this single reply; they run in the order given and you will not see their results
+2. Tool arguments must match the tool's JSON schema exactly
+3. If no tool is needed, answer the request directly in plain text"""
+
+# Summary turn: the tools have already run, so no tool schemas are sent
+SUMMARY_SYSTEM_PROMPT = """You are an expert AI assistant for a Notion workspace.
+Answer the user's request in plain text using the tool results provided. Do not request further tool calls."""
+
+# Errors meaning the MCP subprocess or its stdio pipes are gone, as opposed to
+# a failing tool; -32000 is mcp.types.CONNECTION_CLOSED carried by McpError
+MCP_TRANSPORT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, OSError)
+MCP_CONNECTION_CLOSED = -32000
+
+
+def is_mcp_transport_error(e: Exception) -> bool:
+    if isinstance(e, MCP_TRANSPORT_ERRORS):
+        return True
+    return getattr(getattr(e, "error", None), "code", None) == MCP_CONNECTION_CLOSED
+
+
+# Cap on tool output carried into the next LLM turn so one oversized Notion
+# response cannot blow up the follow-up prompt
+MAX_TOOL_RESULT_CHARS = 16000
+
+
+async def call_mcp_tool(mcp: PersistentMCPSession, tool_name: str, arguments: dict) -> str:
+    """Execute one MCP tool call and return its text output (errors are returned as text for the LLM)"""
+    if tool_name not in mcp.tools_by_name:
+        available_tools = list(mcp.tools_by_name)
+        logger.warning("Tool %r not found. Available tools: %s", tool_name, available_tools)
+        return f"Error: Tool '{tool_name}' not found. Available tools: {', '.join(available_tools)}"
+
+    logger.info("✓ Executing tool: %s", tool_name)
+    logger.debug("✓ Arguments: %.300r", arguments)
+
+    try:
+        tool_result = await mcp.session.call_tool(tool_name, arguments=arguments)
+    except Exception as e:
+        error_msg = f"Error executing tool {tool_name}: {str(e)}"
+        logger.exception("✗ %s", error_msg)
+        if mcp.closed or is_mcp_transport_error(e):
+            discard_mcp_session(mcp)
+        return error_msg
+
+    # Extract result content
+    if hasattr(tool_result, "content") and tool_result.content:
+        result_text = "\n".join(
+            item.text if hasattr(item, "text") else str(item)
+            for item in tool_result.content
+        )
+    else:
+        result_text = str(tool_result)
+
+    logger.debug("✓ Tool result: %.300s...", result_text)
+    if len(result_text) > MAX_TOOL_RESULT_CHARS:
+        result_text = result_text[:MAX_TOOL_RESULT_CHARS] + "\n...[truncated]"
+    return result_text
+
+
+# ------------------------------
+# Enhanced Agent with Persistent Session
+# ------------------------------
+def hit_token_limit(msg) -> bool:
+    return msg.response_metadata.get("finish_reason") == "length"
+
+
+async def run_tool_step(query: str, llm, mcp: PersistentMCPSession):
+    """First agent turn: let the LLM pick tools and execute them.
+
+    Returns the messages for the summary turn, the tools used, and the LLM's
+    direct answer when it needed no tool (None otherwise).
+    """
+    messages = [SystemMessage(content=AGENT_SYSTEM_PROMPT), HumanMessage(content=query)]
+    ai_msg = await llm.bind_tools(
+        mcp.tool_schemas, max_tokens=TOOL_STEP_MAX_TOKENS, temperature=0
+    ).ainvoke(messages)
     
-    # Find JSON between braces
-    brace_start = text.find('{')
-    if brace_start == -1:
-        return None
+    # A tool call cut off by the budget lands in invalid_tool_calls; retry with
+    # the full budget rather than summarizing as if no tool were needed
+    if ai_msg.invalid_tool_calls:
+        logger.warning("Tool call was cut off or malformed, retrying with %d tokens", TOOL_STEP_RETRY_MAX_TOKENS)
+        ai_msg = await llm.bind_tools(
+            mcp.tool_schemas, max_tokens=TOOL_STEP_RETRY_MAX_TOKENS, temperature=0
+        ).ainvoke(messages)
+        if ai_msg.invalid_tool_calls:
+            raise HTTPException(502, "Model did not return a complete tool call")
     
-    # Count braces to find complete JSON
-    brace_count = 0
-    in_string = False
-    escape_next = False
+    if not ai_msg.tool_calls:
+        # A long direct answer is regenerated by the summary turn with its budget
+        if hit_token_limit(ai_msg):
+            return messages, [], None
+        return messages, [], ai_msg.content
     
-    for i in range(brace_start, len(text)):
-        char = text[i]
-        
-        if escape_next:
-            escape_next = False
-            continue
-            
-        if char == '\\':
-            escape_next = True
-            continue
-            
-        if char == '"':
-            in_string = not in_string
-            continue
-            
-        if not in_string:
-            if char == '{':
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    # Found complete JSON
-                    json_str = text[brace_start:i+1]
-                    try:
-                        return json.loads(json_str)
-                    except json.JSONDecodeError as e:
-                        print(f"JSON decode error: {e}")
-                        print(f"Failed JSON string: {json_str}")
-                        return None
+    tools_used: dict[str, None] = {}  # ordered set of tool names
+    tool_outputs = []
+    for tool_call in ai_msg.tool_calls:
+        result_text = await call_mcp_tool(mcp, tool_call["name"], tool_call["args"])
+        tool_outputs.append(f"Tool '{tool_call['name']}' result:\n{result_text}")
+        tools_used[tool_call["name"]] = None
     
-    return None
+    summary_messages = [
+        SystemMessage(content=SUMMARY_SYSTEM_PROMPT),
+        HumanMessage(content=f"Request: {query}\n\n" + "\n\n".join(tool_outputs)),
+    ]
+    return summary_messages, list(tools_used), None
+
+
+@asynccontextmanager
+async def agent_timeout():
+    """60 second budget for one agent phase; a timeout is raised as HTTP 408"""
+    try:
+        async with asyncio.timeout(60):
+            yield
+    except asyncio.TimeoutError:
+        logger.warning("⚠ Operation timed out after 60 seconds")
+        raise HTTPException(408, "Request timeout - operation took too long")
+
+
+async def prepare_agent_answer(query: str, llm, notion_key: str):
+    """Run the tool step on the cached MCP session; shared by the JSON and SSE paths"""
+    async with agent_timeout():
+        async with mcp_session(notion_key) as mcp:
+            return await run_tool_step(query, llm, mcp)
 
 
-# ------------------------------
-# Enhanced Agent with Persistent Session - FIXED
-# ------------------------------
 async def run_agent_with_mcp(query: str, llm, notion_key: str):
-    """Run agent with persistent MCP session throughout execution"""
+    """Run agent with persistent MCP session: one tool-calling turn, then one summary turn"""
+    messages, tools_used, answer = await prepare_agent_answer(query, llm, notion_key)
     
-    server_params = await create_mcp_session(notion_key)
+    if answer is not None:
+        return {"response": answer, "tools_used": tools_used, "iterations": 1, "truncated": False}
     
-    try:
-        async with asyncio.timeout(60):  # 3 minute timeout
-            async with stdio_client(server_params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    
-                    # Create tools description
-                    tools_desc = "\n".join([
-                        f"- {tool.name}: {tool.description}"
-                        for tool in tools_result.tools
-                    ])
-                    
-                    # System prompt - Escape curly braces for LangChain
-                    system_prompt = f"""You are an expert AI assistant with access to Notion workspace tools.
-
-Available tools:
-{tools_desc}
+    async with agent_timeout():
+        final_msg = await llm.ainvoke(messages)
+    
+    truncated = hit_token_limit(final_msg)
+    if truncated:
+        logger.warning("Summary hit the %d token limit and was truncated", SUMMARY_MAX_TOKENS)
+    return {
+        "response": final_msg.content,
+        "tools_used": tools_used,
+        "iterations": 2,
+        "truncated": truncated
+    }
 
-CRITICAL INSTRUCTIONS:
-1. Use tools ONE TIME ONLY per request
-2. Wait for tool results before providing final answer
-3. When using a tool, respond with ONLY these two lines:
-   TOOL_CALL: exact_tool_name
-   TOOL_INPUT: <complete valid JSON on ONE line>
-
-4. The JSON must be COMPLETE and VALID - no partial JSON
-5. After tool execution, provide your final answer in plain text
-
-Example:
-TOOL_CALL: API-create-a-page
-TOOL_INPUT: {{{{"parent": {{{{"type": "page_id", "page_id": "123"}}}}, "properties": {{{{"title": [{{{{"text": {{{{"content": "My Page"}}}}}}}}]}}}}}}}}"""
-
-                    prompt = ChatPromptTemplate.from_messages([
-                        ("system", system_prompt),
-                        ("user", "{query}")
-                    ])
-                    
-                    chain = prompt | llm | StrOutputParser()
-                    
-                    max_iterations = 5  # REDUCED from 10 to prevent timeout
-                    conversation_history = []
-                    tools_used = []
-                    
-                    for iteration in range(max_iterations):
-                        print(f"\n=== Iteration {iteration + 1} ===")
-                        
-                        # Get LLM response
-                        if iteration == 0:
-                            response = await asyncio.to_thread(chain.invoke, {"query": query})
-                        else:
-                            context = "\n\n".join(conversation_history[-4:])  # Last 2 exchanges
-                            full_query = f"Previous context:\n{context}\n\nProvide final answer for: {query}"
-                            response = await asyncio.to_thread(chain.invoke, {"query": full_query})
-                        
-                        print(f"LLM Response: {response[:300]}...")
-                        conversation_history.append(f"Assistant: {response}")
-                        
-                        # Check if tool usage is requested
-                        if "TOOL_CALL:" in response and "TOOL_INPUT:" in response:
-                            try:
-                                # Extract tool name
-                                tool_match = re.search(r'TOOL_CALL:\s*(\S+)', response)
-                                if not tool_match:
-                                    print("Could not parse tool name")
-                                    continue
-                                
-                                tool_name = tool_match.group(1).strip()
-                                print(f"DEBUG: Extracted tool name: '{tool_name}'")
-                                
-                                # Extract tool input - get everything after TOOL_INPUT: up to next line break or end
-                                input_match = re.search(r'TOOL_INPUT:\s*(.+?)(?:\n|$)', response, re.DOTALL)
-                                if not input_match:
-                                    print("Could not parse tool input")
-                                    continue
-                                
-                                tool_input_text = input_match.group(1).strip()
-                                print(f"DEBUG: Extracted tool input text: '{tool_input_text}'")
-                                print(f"DEBUG: Tool input repr: {repr(tool_input_text)}")
-                                
-                                # Parse JSON - try direct parse first
-                                try:
-                                    arguments = json.loads(tool_input_text)
-                                    print(f"DEBUG: Direct JSON parse successful: {arguments}")
-                                except json.JSONDecodeError as e:
-                                    print(f"DEBUG: Direct parse failed ({e}), trying extract_complete_json")
-                                    arguments = extract_complete_json(tool_input_text)
-                                
-                                if arguments is None:
-                                    print(f"ERROR: Could not parse JSON from: {tool_input_text[:200]}")
-                                    # Add error to conversation to help LLM correct itself
-                                    conversation_history.append(f"Error: Invalid JSON format. Please provide valid JSON for TOOL_INPUT.")
-                                    continue
-                                
-                                # Find the tool
-                                mcp_tool = next((t for t in tools_result.tools if t.name == tool_name), None)
-                                
-                                if not mcp_tool:
-                                    print(f"Tool '{tool_name}' not found")
-                                    available_tools = [t.name for t in tools_result.tools]
-                                    print(f"Available tools: {available_tools}")
-                                    conversation_history.append(f"Error: Tool '{tool_name}' not found. Available tools: {', '.join(available_tools)}")
-                                    continue
-                                
-                                print(f"✓ Executing tool: {tool_name}")
-                                print(f"✓ Arguments: {json.dumps(arguments, indent=2)[:300]}")
-                                
-                                # Execute tool
-                                try:
-                                    tool_result = await session.call_tool(tool_name, arguments=arguments)
-                                    
-                                    # Extract result content
-                                    if hasattr(tool_result, "content") and tool_result.content:
-                                        result_text = "\n".join(
-                                            item.text if hasattr(item, "text") else str(item)
-                                            for item in tool_result.content
-                                        )
-                                    else:
-                                        result_text = str(tool_result)
-                                    
-                                    print(f"✓ Tool result: {result_text[:300]}...")
-                                    conversation_history.append(f"Tool '{tool_name}' result: {result_text}")
-                                    tools_used.append(tool_name)
-                                    
-                                    # SUCCESS - get final answer in next iteration
-                                    continue
-                                    
-                                except Exception as e:
-                                    error_msg = f"Error executing tool {tool_name}: {str(e)}"
-                                    print(f"✗ {error_msg}")
-                                    traceback.print_exc()
-                                    conversation_history.append(error_msg)
-                                    
-                            except Exception as e:
-                                print(f"Error in tool execution block: {e}")
-                                traceback.print_exc()
-                        
-                        # If this iteration had no tool call, return response
-                        if iteration > 0 and "TOOL_CALL:" not in response:
-                            return {
-                                "response": response,
-                                "tools_used": list(set(tools_used)),
-                                "iterations": iteration + 1
-                            }
-                    
-                    # Return final response after max iterations
-                    return {
-                        "response": conversation_history[-1].replace("Assistant: ", "") if conversation_history else response,
-                        "tools_used": list(set(tools_used)),
-                        "iterations": max_iterations
-                    }
+
+def sse_event(data: dict) -> bytes:
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+async def stream_agent_with_mcp(query: str, llm, notion_key: str):
+    """Run the tool step, then return an SSE generator that streams the final answer.
+
+    The tool step runs before the response starts so its errors still map to
+    HTTP status codes; failures while streaming are sent as an error event.
+    """
+    messages, tools_used, answer = await prepare_agent_answer(query, llm, notion_key)
     
-    except asyncio.TimeoutError:
-        print("⚠ Operation timed out after 180 seconds")
-        raise HTTPException(408, "Request timeout - operation took too long")
-    except Exception as e:
-        print(f"⚠ Error in run_agent_with_mcp: {e}")
-        traceback.print_exc()
-        raise
+    async def event_stream():
+        truncated = False
+        try:
+            if answer is not None:
+                yield sse_event({"delta": answer})
+            else:
+                async with asyncio.timeout(60):  # same budget as the JSON summary turn
+                    async for chunk in llm.astream(messages):
+                        truncated = truncated or hit_token_limit(chunk)
+                        if chunk.content:
+                            yield sse_event({"delta": chunk.content})
+                if truncated:
+                    logger.warning("Summary hit the %d token limit and was truncated", SUMMARY_MAX_TOKENS)
+            
+            yield sse_event({
+                "done": True,
+                "model": "kimi-k2-instruct-0905",
+                "tools_used": tools_used,
+                "iterations": 1 if answer is not None else 2,
+                "truncated": truncated
+            })
+        except asyncio.TimeoutError:
+            logger.warning("⚠ Streaming timed out after 60 seconds")
+            yield sse_event({"error": "Request timeout - operation took too long"})
+        except Exception as e:
+            logger.exception("⚠ Error while streaming answer: %s", e)
+            yield sse_event({"error": str(e)})
+    
+    return event_stream()
 
 
 # ------------------------------
@@ -362,7 +527,7 @@ TOOL_INPUT: {{{{"parent": {{{{"type": "page_id", "page_id": "123"}}}}, "properti
 @app.post("/api/query")
 async def query_agent(request: Request):
     try:
-        body = await request.json()
+        body = await read_json_body(request)
         notion_key = body.get("notion_key", "").strip()
         fireworks_key = body.get("fireworks_key", "").strip()
         query = body.get("query", "").strip()
@@ -370,13 +535,12 @@ async def query_agent(request: Request):
         if not query:
             raise HTTPException(400, "Query is required")
 
-        # Fireworks Kimi K2 LLM - Lower temperature for better instruction following
-        llm = ChatFireworks(
-            model="accounts/fireworks/models/kimi-k2-instruct-0905",
-            api_key=fireworks_key,
-            temperature=0.3,  # Lower for more deterministic behavior
-            max_tokens=4096,
-        )
+        llm = get_llm(fireworks_key)
+
+        # Clients that accept SSE get the final answer token by token
+        if "text/event-stream" in request.headers.get("accept", ""):
+            events = await stream_agent_with_mcp(query, llm, notion_key)
+            return StreamingResponse(events, media_type="text/event-stream")
 
         # Run agent with persistent MCP session
         result = await run_agent_with_mcp(query, llm, notion_key)
@@ -385,11 +549,14 @@ async def query_agent(request: Request):
             "response": result["response"],
             "model": "kimi-k2-instruct-0905",
             "tools_used": result.get("tools_used", []),
-            "iterations": result.get("iterations", 0)
+            "iterations": result.get("iterations", 0),
+            "truncated": result.get("truncated", False)
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(traceback.format_exc())
+        logger.exception("Query failed")
         raise HTTPException(500, str(e))
 
 
@@ -399,6 +566,13 @@ async def query_agent(request: Request):
 if __name__ == "__main__":
     import uvicorn
     
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    # loop/http stay "auto": uvicorn[standard] already selects uvloop and httptools
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        log_level="warning",
+        access_log=False,
+    )
 
 
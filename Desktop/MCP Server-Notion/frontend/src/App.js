@@ -159,10 +159,17 @@ ${data.tools.map(t => `• ${t}`).join('\n')}
     setInput('');
     setLoading(true);
 
+    // Streamed agent reply, identified by its timestamp
+    const agentTimestamp = new Date();
+    let content = '';
+
     try {
       const response = await fetch(`${API_URL}/api/query`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+          'Content-Type': 'application/json',
+          'Accept': 'text/event-stream'
+        },
         body: JSON.stringify({
           query: currentInput,
           notion_key: notionKey,
@@ -172,24 +179,60 @@ ${data.tools.map(t => `• ${t}`).join('\n')}
 
       if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
 
-      const data = await response.json();
-
-      const agentResponse = {
-        type: 'agent',
-        content: data.response,
-        timestamp: new Date(),
-        tools_used: data.tools_used || [],
-        model: data.model
+      // Add an empty agent message and grow it as SSE deltas arrive
+      const updateAgentMessage = (fields) => {
+        setMessages(prev => prev.map(m => m.timestamp === agentTimestamp ? { ...m, ...fields } : m));
       };
+      setMessages(prev => [...prev, {
+        type: 'agent',
+        content: '',
+        timestamp: agentTimestamp,
+        tools_used: []
+      }]);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let finished = false;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+          if (!event.startsWith('data: ')) continue;
+          const data = JSON.parse(event.slice(6));
+
+          if (data.error) throw new Error(data.error);
+          if (data.delta) {
+            content += data.delta;
+            updateAgentMessage({ content });
+          }
+          if (data.done) {
+            finished = true;
+            if (data.truncated) content += '\n\n⚠️ Answer was cut off at the length limit.';
+            updateAgentMessage({ content, tools_used: data.tools_used || [], model: data.model });
+          }
+        }
+      }
 
-      setMessages(prev => [...prev, agentResponse]);
+      // A stream that closes without a done event was cut off
+      if (!finished) throw new Error('Response ended before it was complete');
     } catch (error) {
       const errorMessage = {
         type: 'system',
         content: '❌ Error: ' + error.message,
         timestamp: new Date()
       };
-      setMessages(prev => [...prev, errorMessage]);
+      // Drop the agent placeholder if nothing was streamed into it
+      setMessages(prev => [
+        ...prev.filter(m => content || m.timestamp !== agentTimestamp),
+        errorMessage
+      ]);
     } finally {
       setLoading(false);
     }